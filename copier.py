@@ -1,10 +1,27 @@
 import os
 import asyncio
+import atexit
 import logging
-import time
+import logging.handlers
+import random
+import re
+import signal
+from collections import OrderedDict, deque
+from queue import SimpleQueue
 from telethon import TelegramClient, events
 from telethon.errors import FloodWaitError, RPCError
 from telethon.sessions import StringSession
+from telethon.tl.types import MessageMediaWebPage
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
 
 # ================= ENV =================
 
@@ -20,81 +37,361 @@ SOURCE_CHATS = [
 
 TARGET_CHAT = int(os.getenv("TARGET_CHAT"))
 
+LOCK_FILE = os.getenv("LOCK_FILE", "copier.lock")
+
 RATE_DELAY = 0.4
-MAX_RUNTIME_SECONDS = 5 * 60 * 60  # 5 hours
+WORKERS = int(os.getenv("WORKERS", "2"))
+SIGNAL_KEYWORDS = ("BUY", "SELL")
+
+QUEUE_SIZE = 500
+MAX_QUEUE_AGE = 60  # seconds a queued message stays worth sending
+MAX_SEEN = 5000
+RECENT_SIZE = 256
+RECENT_WINDOW = 5  # seconds
+SEND_ATTEMPTS = 6
+MAX_BACKOFF = 60
+# 5 hours fits a scheduled CI job; 0 runs until SIGTERM (container/VPS).
+MAX_RUNTIME_SECONDS = int(os.getenv("MAX_RUNTIME_SECONDS", 5 * 60 * 60))
 
 # ================= LOGGING =================
 
+# Records are formatted where they are logged and handed to a listener
+# thread, so console writes never block the event loop.
+log_queue = SimpleQueue()
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    logging.StreamHandler()
+)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s"
+    format="%(asctime)s | %(levelname)s | %(message)s",
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
 
 logger = logging.getLogger("relay")
 
-# ================= SAFE FORWARD =================
+# ================= RATE LIMIT =================
+
+class RateLimiter:
+    # Each caller reserves the next free slot and sleeps until it comes up.
+    # No lock needed: the event loop is single-threaded.
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.next_slot = 0.0
+        self._loop = None
+
+    async def wait(self):
+        loop = self._loop or asyncio.get_running_loop()
+        self._loop = loop
+
+        now = loop.time()
+        slot = max(self.next_slot, now)
+        self.next_slot = slot + self.delay
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def hold(self, seconds):
+        # Push every caller's next slot past a FloodWait.
+        loop = self._loop or asyncio.get_running_loop()
+        self._loop = loop
+
+        self.next_slot = max(self.next_slot, loop.time() + seconds)
+
+rate_limiter = RateLimiter(RATE_DELAY)
+
+# ================= QUEUES =================
+
+# Trade signals jump ahead of ordinary updates. Every queued message
+# releases `pending` once, so the worker wakes for either queue.
+high_queue = asyncio.Queue(QUEUE_SIZE)
+low_queue = asyncio.Queue(QUEUE_SIZE)
+pending = asyncio.Semaphore(0)
+
+_SIGNAL_RE = re.compile(
+    "|".join(re.escape(k) for k in SIGNAL_KEYWORDS),
+    re.IGNORECASE
+)
+
+def detect_signal(text):
+    return bool(text and _SIGNAL_RE.search(text))
+
+def enqueue(message):
+    now = asyncio.get_running_loop().time()
+    key = recent_key(message)
+
+    if key is not None and recently_queued(key, now):
+        return
+
+    queue = high_queue if detect_signal(message.raw_text) else low_queue
+    deadline = now + MAX_QUEUE_AGE
+
+    try:
+        queue.put_nowait((deadline, message))
+    except asyncio.QueueFull:
+        logger.warning(f"Queue full, dropping {message.chat_id}/{message.id}")
+        return
+
+    if key is not None:
+        mark_queued(key, now)
+
+    pending.release()
+
+async def next_message():
+    await pending.acquire()
 
-async def safe_forward(client, message):
     try:
-        if message.media:
-            await client.send_file(
-                TARGET_CHAT,
-                message.media,
-                caption=message.text or ""
-            )
-        elif message.text:
-            await client.send_message(
-                TARGET_CHAT,
-                message.text
-            )
-
-        await asyncio.sleep(RATE_DELAY)
-
-    except FloodWaitError as e:
-        logger.warning(f"FloodWait {e.seconds}s")
-        await asyncio.sleep(e.seconds)
-        await safe_forward(client, message)
-
-    except RPCError as e:
-        logger.error(f"RPCError: {e}")
-
-    except Exception as e:
-        logger.error(f"Send error: {e}")
+        return high_queue.get_nowait()
+    except asyncio.QueueEmpty:
+        return low_queue.get_nowait()
+
+# ================= DEDUP =================
+
+# Telegram can deliver the same update twice (e.g. around reconnects).
+# (chat_id, message id) is unique, so a bounded id set is enough.
+seen_order = deque(maxlen=MAX_SEEN)
+seen_ids = set()
+
+def already_seen(message):
+    key = (message.chat_id, message.id)
+
+    if key in seen_ids:
+        return True
+
+    if len(seen_order) == MAX_SEEN:
+        seen_ids.discard(seen_order[0])
+
+    seen_order.append(key)
+    seen_ids.add(key)
+    return False
+
+# Several sources often repost the same signal within moments of each
+# other. Catch those before they take a queue slot.
+recent = OrderedDict()
+
+def recent_key(message):
+    text = message.raw_text
+    media = message.photo or message.document
+
+    if not text and media is None:
+        return None
+
+    return hash((text, media.id if media else None))
+
+def recently_queued(key, now):
+    queued_at = recent.get(key)
+    return queued_at is not None and now - queued_at < RECENT_WINDOW
+
+# Only called once the message is actually queued, so a copy dropped on
+# QueueFull does not suppress the reposts that follow it.
+def mark_queued(key, now):
+    recent[key] = now
+    recent.move_to_end(key)
+
+    if len(recent) > RECENT_SIZE:
+        recent.popitem(last=False)
+
+# ================= SAFE FORWARD =================
+
+async def send_once(client, target, message):
+    # Raw text plus the original entities skips Telethon's markdown
+    # unparse/parse round trip and keeps the formatting exact.
+    # parse_mode=None stops plain messages (entities is None) from being
+    # parsed as markdown, so "**" or "[x](url)" stay literal.
+    text = message.raw_text
+    entities = message.entities
+
+    # Photos and documents go out as InputMedia references, so Telegram
+    # copies them server-side. Link previews are not sendable media.
+    if message.media and not isinstance(message.media, MessageMediaWebPage):
+        await client.send_file(
+            target,
+            message.media,
+            caption=text or "",
+            formatting_entities=entities,
+            parse_mode=None
+        )
+    elif text:
+        await client.send_message(
+            target,
+            text,
+            formatting_entities=entities,
+            parse_mode=None
+        )
+
+async def safe_forward(client, target, message, deadline):
+    loop = asyncio.get_running_loop()
+    backoff = 1.0
+
+    for attempt in range(1, SEND_ATTEMPTS + 1):
+        try:
+            await rate_limiter.wait()
+
+            # Another worker's FloodWait hold may have pushed this slot
+            # past the message's deadline.
+            if loop.time() > deadline:
+                logger.warning(f"Stale, dropping {message.chat_id}/{message.id}")
+                return
+
+            await send_once(client, target, message)
+            return
+
+        except FloodWaitError as e:
+            logger.warning(f"FloodWait {e.seconds}s")
+            rate_limiter.hold(e.seconds + 1)
+
+            # Retry after the hold unless the wait outlasts the message.
+            if loop.time() + e.seconds > deadline:
+                logger.warning(f"Stale after FloodWait, dropping {message.chat_id}/{message.id}")
+                return
+
+            continue
+
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            backoff = min(MAX_BACKOFF, backoff * 2)
+            delay = backoff + random.uniform(0, backoff)
+            logger.warning(f"Network error (attempt {attempt}): {e}")
+
+        except RPCError as e:
+            logger.error(f"RPCError: {e}")
+            return
+
+        except Exception as e:
+            logger.error(f"Send error: {e}")
+            return
+
+        if attempt == SEND_ATTEMPTS:
+            break
+
+        if loop.time() + delay > deadline:
+            logger.warning(f"Stale before retry, dropping {message.chat_id}/{message.id}")
+            return
+
+        await asyncio.sleep(delay)
+
+    logger.error(f"Giving up on {message.chat_id}/{message.id} after {SEND_ATTEMPTS} attempts")
+
+async def worker(client, target):
+    loop = asyncio.get_running_loop()
+
+    while True:
+        deadline, message = await next_message()
+
+        if loop.time() > deadline:
+            logger.warning(f"Stale, dropping {message.chat_id}/{message.id}")
+            continue
+
+        if already_seen(message):
+            continue
+
+        await safe_forward(client, target, message, deadline)
 
 # ================= TELEGRAM CORE =================
 
-async def run_bot():
-    start_time = time.time()
+# Returns the target's InputPeer so sends skip the entity lookup; falls
+# back to the raw id if it could not be resolved.
+async def check_chats(client):
+    chats = SOURCE_CHATS + [TARGET_CHAT]
+
+    results = await asyncio.gather(
+        *(client.get_input_entity(chat) for chat in chats),
+        return_exceptions=True
+    )
+
+    for chat, result in zip(chats, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Chat {chat} not resolvable: {result}")
+
+    target = results[-1]
+    return TARGET_CHAT if isinstance(target, Exception) else target
+
+# Two processes on the same session corrupt each other's MTProto state,
+# so only the one holding the lock may connect. The OS drops the lock
+# when the process exits.
+def acquire_session_lock():
+    if fcntl is None:
+        return True
+
+    try:
+        fd = os.open(LOCK_FILE, os.O_CREAT | os.O_RDWR)
+    except OSError as e:
+        logger.warning(f"Cannot open {LOCK_FILE}, running unlocked: {e}")
+        return True
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    except OSError as e:
+        os.close(fd)
+        logger.warning(f"Cannot lock {LOCK_FILE}, running unlocked: {e}")
+
+    return True
 
+async def run_bot():
+    # flood_sleep_threshold=0 makes every FloodWait raise into
+    # safe_forward, where the shared limiter holds all workers; Telethon
+    # would otherwise sleep through waits <= 60s inside one worker only.
     async with TelegramClient(
         StringSession(SESSION_STRING),
         API_ID,
-        API_HASH
+        API_HASH,
+        flood_sleep_threshold=0
     ) as client:
 
+        target = await check_chats(client)
+
         logger.info("Telegram connected. Listener active.")
 
-        @client.on(events.NewMessage)
+        # Filtering by chats= happens inside Telethon before a handler
+        # task is spawned, so updates from other chats cost nothing.
+        @client.on(events.NewMessage(chats=SOURCE_CHATS))
         async def handler(event):
             try:
-                if event.chat_id not in SOURCE_CHATS:
-                    return
-
-                await safe_forward(client, event.message)
+                enqueue(event.message)
 
             except Exception as e:
                 logger.error(f"Handler error: {e}")
 
-        # Runtime monitor loop
-        while True:
-            elapsed = time.time() - start_time
+        # Workers share the rate limiter, so extra workers overlap send
+        # round trips without sending faster than RATE_DELAY.
+        worker_tasks = [
+            asyncio.create_task(worker(client, target))
+            for _ in range(WORKERS)
+        ]
 
-            if elapsed >= MAX_RUNTIME_SECONDS:
-                logger.info("5 hours reached. Restarting cleanly...")
-                await client.disconnect()
-                break
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
 
-            await asyncio.sleep(10)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass  # Windows
+
+        try:
+            await asyncio.wait_for(stop.wait(), MAX_RUNTIME_SECONDS or None)
+            logger.info("Stop signal received. Shutting down...")
+        except asyncio.TimeoutError:
+            logger.info("Runtime limit reached. Restarting cleanly...")
+
+        for task in worker_tasks:
+            task.cancel()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+
+        await client.disconnect()
 
 if __name__ == "__main__":
-    asyncio.run(run_bot())
+    if not acquire_session_lock():
+        logger.info(f"{LOCK_FILE} is held by another copier. Exiting.")
+        raise SystemExit(0)
+
+    if uvloop:
+        uvloop.run(run_bot())
+    else:
+        asyncio.run(run_bot())
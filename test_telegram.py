@@ -1,7 +1,5 @@
 import os
 import asyncio
-from telethon import TelegramClient, errors
-from telethon.sessions import StringSession
 
 # =========================
 # SAFE ENV LOADING
@@ -23,21 +21,22 @@ except Exception as e:
     raise SystemExit(1)
 
 
-# =========================
-# CLIENT
-# =========================
-client = TelegramClient(
-    StringSession(SESSION_STRING),
-    API_ID,
-    API_HASH
-)
-
-
 # =========================
 # TEST LOGIC
 # =========================
 async def main():
 
+    # Telethon is only imported once the ENV checks have passed, so a
+    # misconfigured run fails without paying its import cost.
+    from telethon import TelegramClient, errors
+    from telethon.sessions import StringSession
+
+    client = TelegramClient(
+        StringSession(SESSION_STRING),
+        API_ID,
+        API_HASH
+    )
+
     print("🔄 Connecting to Telegram...")
 
     try: